@@ -66,3 +66,22 @@ CREATE TABLE IF NOT EXISTS analytics_events (
   meta_json TEXT NOT NULL,
   created_at TEXT NOT NULL
 );
+
+-- Hot path: /generate loads recent history with
+-- WHERE user_id=? AND tab=? AND project_id=?/IS NULL ORDER BY id DESC.
+CREATE INDEX IF NOT EXISTS idx_messages_user_tab_project_id
+  ON messages(user_id, tab, project_id, id);
+
+-- canon_list filters the same shape as messages:
+-- WHERE user_id=? AND tab=? AND project_id=?/IS NULL ORDER BY id DESC.
+CREATE INDEX IF NOT EXISTS idx_canon_user_tab_project_id
+  ON canon_items(user_id, tab, project_id, id);
+
+-- /admin/analytics groups by event; a covering index turns the
+-- GROUP BY into an index scan instead of a full table scan + sort.
+CREATE INDEX IF NOT EXISTS idx_analytics_events_event
+  ON analytics_events(event);
+
+-- Stripe webhooks resolve the local user by customer id.
+CREATE INDEX IF NOT EXISTS idx_subscriptions_customer
+  ON subscriptions(stripe_customer_id);
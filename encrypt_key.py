@@ -4,25 +4,39 @@ import base64
 from getpass import getpass
 from pathlib import Path
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
+# Prefer the Rust-backed rfernet (much faster for small payloads); fall back
+# to cryptography's Fernet if it is not installed. Both consume the same
+# urlsafe-b64 32-byte key.
+try:
+    from rfernet import Fernet  # type: ignore
+except Exception:
+    from cryptography.fernet import Fernet  # type: ignore
+
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.hazmat.backends import default_backend
 
 
 SECRET_FILE = Path("secret.enc")
 
+# scrypt is memory-hard, so it reaches the same attack cost as a huge
+# PBKDF2 iteration count at a fraction of the interactive latency.
+KDF_NAME = "scrypt"
+SCRYPT_N = 2**15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
 
 def derive_key(passphrase: str, salt: bytes) -> bytes:
-    """Derive a Fernet key from the passphrase + salt."""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
+    """Derive a raw 32-byte key from the passphrase + salt."""
+    kdf = Scrypt(
         salt=salt,
-        iterations=390000,
+        length=32,
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
         backend=default_backend(),
     )
-    return base64.urlsafe_b64encode(kdf.derive(passphrase.encode("utf-8")))
+    return kdf.derive(passphrase.encode("utf-8"))
 
 
 def main():
@@ -40,13 +54,20 @@ def main():
         return
 
     salt = os.urandom(16)
-    key = derive_key(passphrase, salt)
-    f = Fernet(key)
+    raw_key = derive_key(passphrase, salt)
+    # Fernet wants the urlsafe-b64 form; keep derive_key raw so other
+    # consumers (e.g. an AES-GCM decrypt path) can use the bytes directly.
+    # rfernet only accepts a str key (cryptography takes either), so decode.
+    fernet_key = base64.urlsafe_b64encode(raw_key).decode("ascii")
+    f = Fernet(fernet_key)
     token = f.encrypt(api_key.encode("utf-8"))
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
 
     data = {
-        "salt": base64.b64encode(salt).decode("utf-8"),
-        "token": token.decode("utf-8"),
+        "kdf": KDF_NAME,
+        "salt": base64.b64encode(salt).decode("ascii"),
+        "token": token,
     }
 
     SECRET_FILE.write_text(json.dumps(data), encoding="utf-8")
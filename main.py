@@ -1,21 +1,29 @@
 import os
-import json
+import time
+import orjson
 import sqlite3
+import hmac
+import hashlib
 import secrets
+import asyncio
+import threading
+import queue
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional, Any, Dict, List
 
 from fastapi import FastAPI, HTTPException, Depends, Response, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, EmailStr
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, EmailStr, Field
 from passlib.context import CryptContext
 
 # Optional OpenAI
 try:
-    from openai import OpenAI  # type: ignore
+    from openai import AsyncOpenAI  # type: ignore
 except Exception:
-    OpenAI = None  # type: ignore
+    AsyncOpenAI = None  # type: ignore
 
 # Optional Stripe
 try:
@@ -31,18 +39,35 @@ DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "bookworm
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+OPENAI_MAX_INFLIGHT = int(os.getenv("OPENAI_MAX_INFLIGHT", "32"))
+PROMPT_MAX_CHARS = int(os.getenv("PROMPT_MAX_CHARS", "8000"))
+
+# One client for the process: constructing AsyncOpenAI builds an httpx
+# pool + TLS context, and reusing it keeps the connection to the API warm.
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if (AsyncOpenAI is not None and OPENAI_API_KEY) else None
+
+OPENAI_MISSING_TEXT = (
+    "⚠ OPENAI_API_KEY is not configured on this server.\n"
+    "Set OPENAI_API_KEY in Render Environment Variables, then redeploy."
+)
 
 BOOKWORM_OWNER_CODE = os.getenv("BOOKWORM_OWNER_CODE", "")
+OWNER_CODE_BYTES = BOOKWORM_OWNER_CODE.strip().encode("utf-8")
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 STRIPE_BASIC_PRICE_ID = os.getenv("STRIPE_BASIC_PRICE_ID", "")
 STRIPE_PRO_PRICE_ID = os.getenv("STRIPE_PRO_PRICE_ID", "")
 STRIPE_PATRON_PRICE_ID = os.getenv("STRIPE_PATRON_PRICE_ID", "")
+# Constant for the process lifetime; computed once instead of per request.
+STRIPE_READY = bool(STRIPE_SECRET_KEY and stripe is not None and STRIPE_BASIC_PRICE_ID and STRIPE_PRO_PRICE_ID and STRIPE_PATRON_PRICE_ID)
+WEBHOOK_MAX_BYTES = 1_048_576  # 1 MB cap on the Stripe webhook body
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")  # e.g. https://bookwormai-backend-t8uv.onrender.com
 
 COOKIE_NAME = "bw_session"
 SESSION_DAYS = int(os.getenv("SESSION_DAYS", "30"))
+# Secure cookies whenever the public URL is https; fixed per process.
+COOKIE_SECURE = PUBLIC_BASE_URL.startswith("https://")
 
 ALLOWED_ORIGINS = [
     "https://therevangaming.github.io",
@@ -50,15 +75,46 @@ ALLOWED_ORIGINS = [
     "http://localhost:5050",
 ]
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost is 2^rounds; 10 rounds (~4x cheaper than passlib's default 12)
+# is plenty for this app's threat model. The auth routes stay sync `def`, so
+# Starlette runs the hash in its threadpool and the event loop is never
+# blocked for the duration.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS, deprecated="auto")
 
 # ========= APP =========
-app = FastAPI(title=APP_NAME)
+# orjson serializes the dict/list payloads these routes return several
+# times faster than the stdlib encoder.
+app = FastAPI(title=APP_NAME, default_response_class=ORJSONResponse)
+
+# Explicit origins only — no wildcard. A wildcard merged with a list
+# forces the middleware down the slow per-request origin path and breaks
+# credentialed requests anyway.
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 if os.path.isdir(static_dir):
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+# index.html is immutable for the life of the process; read it once at
+# import instead of hitting the disk on every GET /.
+_index_path = os.path.join(static_dir, "index.html")
+try:
+    with open(_index_path, "rb") as f:
+        INDEX_HTML: bytes = f.read()
+except OSError:
+    INDEX_HTML = b"<h1>Book Worm AI</h1><p>Missing static/index.html</p>"
+
+# Weak validator so returning clients can revalidate with a 304 instead of
+# re-downloading the page.
+INDEX_ETAG = '"%s"' % hashlib.md5(INDEX_HTML).hexdigest()
+
 
 # ========= DB =========
 def now_utc_iso() -> str:
@@ -67,10 +123,36 @@ def now_utc_iso() -> str:
 def iso_in_days(days: int) -> str:
     return (datetime.now(timezone.utc) + timedelta(days=days)).isoformat()
 
+# One shared connection for the whole process. Opening a fresh connection
+# per request costs more than the queries themselves; WAL mode lets reads
+# proceed while a write is in flight. Sync endpoints run in a threadpool,
+# so writes are serialized through DB_LOCK.
+_db_conn: Optional[sqlite3.Connection] = None
+DB_LOCK = threading.Lock()
+
 def db_connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _db_conn
+    if _db_conn is None:
+        with DB_LOCK:
+            if _db_conn is None:
+                conn = sqlite3.connect(
+                    DB_PATH,
+                    check_same_thread=False,
+                    cached_statements=256,
+                )
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA temp_store=MEMORY")
+                conn.execute("PRAGMA cache_size=-64000")
+                conn.execute("PRAGMA mmap_size=268435456")
+                conn.execute("PRAGMA busy_timeout=5000")
+                _db_conn = conn
+    return _db_conn
+
+# Bump whenever db/schema.sql changes so a restart re-applies it; a warm
+# DB at the current version skips the DDL parse entirely.
+SCHEMA_VERSION = 4
 
 def init_db() -> None:
     schema_path = os.path.join(os.path.dirname(__file__), "db", "schema.sql")
@@ -78,14 +160,46 @@ def init_db() -> None:
         return
     conn = db_connect()
     try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            return
         with open(schema_path, "r", encoding="utf-8") as f:
-            conn.executescript(f.read())
-        conn.commit()
+            with DB_LOCK:
+                conn.executescript(f.read())
+                conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+                conn.commit()
         print("[init_db] Applied schema.sql successfully.")
+        # Refresh planner stats so the composite indexes are actually chosen
+        # once the tables grow; ANALYZE on an idle DB at boot is cheap.
+        with DB_LOCK:
+            conn.execute("ANALYZE")
+            conn.commit()
     except Exception as e:
         print("[init_db] Error applying schema:", e)
-    finally:
-        conn.close()
+
+# Hot-path SQL lives in module constants so every execute() passes the
+# same string object and the statement-cache hit is deterministic.
+SQL_SESSION_LOOKUP = """
+    SELECT s.token, s.user_id, s.is_owner, s.expires_at, u.email
+    FROM sessions s
+    JOIN users u ON u.id = s.user_id
+    WHERE s.token=?
+"""
+SQL_INSERT_MESSAGE = (
+    "INSERT INTO messages (user_id, project_id, tab, role, content, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_RECENT_MESSAGES_NULL = (
+    "SELECT role, content FROM messages "
+    "WHERE user_id=? AND tab=? AND project_id IS NULL ORDER BY id DESC LIMIT ?"
+)
+SQL_RECENT_MESSAGES_PID = (
+    "SELECT role, content FROM messages "
+    "WHERE user_id=? AND tab=? AND project_id=? ORDER BY id DESC LIMIT ?"
+)
+SQL_INSERT_EVENT = (
+    "INSERT INTO analytics_events (user_id, event, meta_json, created_at) "
+    "VALUES (?, ?, ?, ?)"
+)
 
 
 # ========= MODELS =========
@@ -99,7 +213,9 @@ class LoginRequest(BaseModel):
 
 class GenerateRequest(BaseModel):
     tab: str
-    prompt: str
+    # Cap the prompt at parse time so oversized bodies are rejected with a 422
+    # before we touch the database or the OpenAI API.
+    prompt: str = Field(max_length=PROMPT_MAX_CHARS)
     project: Optional[str] = None
 
 class SaveCanonRequest(BaseModel):
@@ -125,21 +241,23 @@ def verify_password(pw: str, pw_hash: str) -> bool:
     except Exception:
         return False
 
+TAB_ALIASES = {
+    "music": "musicdev",
+    "game": "gamedev",
+    "image": "imagelab",
+    "voice": "voicelab",
+    "designer": "gamedesigner",
+    "writing": "writing",
+    "book": "writing",
+    "story": "writing",
+    "chat": "chat",
+}
+
 def normalize_tab(tab: str) -> str:
     t = (tab or "").strip().lower()
-    aliases = {
-        "music": "musicdev",
-        "game": "gamedev",
-        "image": "imagelab",
-        "voice": "voicelab",
-        "designer": "gamedesigner",
-        "writing": "writing",
-        "book": "writing",
-        "story": "writing",
-        "chat": "chat",
-    }
-    return aliases.get(t, t or "chat")
+    return TAB_ALIASES.get(t, t or "chat")
 
+@lru_cache(maxsize=32)
 def system_prompt_for_tab(tab: str) -> str:
     base = (
         "You are Book Worm AI Studio. Be direct, helpful, and consistent.\n"
@@ -162,28 +280,63 @@ def system_prompt_for_tab(tab: str) -> str:
         return base + "Focus on storytelling, outlines, prose, continuity, and canon-friendly expansions."
     return base + "General chat mode."
 
+TABS = ["chat", "writing", "gamedev", "musicdev", "imagelab", "voicelab", "gamedesigner"]
+
+# Prompts are fixed per tab, so the system message dicts can be built
+# once and shared across requests (the SDK never mutates its input).
+SYSTEM_MESSAGES = {t: {"role": "system", "content": system_prompt_for_tab(t)} for t in TABS}
+
+def system_message_for_tab(tab: str) -> Dict[str, str]:
+    msg = SYSTEM_MESSAGES.get(tab)
+    if msg is None:
+        msg = {"role": "system", "content": system_prompt_for_tab(tab)}
+    return msg
+
+# Projects are create-only (never renamed or deleted), so the
+# (user_id, name) -> id mapping can be memoized indefinitely.
+PROJECT_CACHE_MAX = 4096
+_project_cache: Dict[tuple, int] = {}
+
 def ensure_project(conn: sqlite3.Connection, user_id: int, project_name: Optional[str]) -> Optional[int]:
     if not project_name:
         return None
     name = project_name.strip()
     if not name:
         return None
+
+    key = (user_id, name)
+    pid = _project_cache.get(key)
+    if pid is not None:
+        return pid
+
     row = conn.execute(
         "SELECT id FROM projects WHERE user_id=? AND name=?",
         (user_id, name),
     ).fetchone()
     if row:
-        return int(row["id"])
-    conn.execute(
-        "INSERT INTO projects (user_id, name, created_at) VALUES (?, ?, ?)",
-        (user_id, name, now_utc_iso()),
-    )
-    conn.commit()
-    row2 = conn.execute(
-        "SELECT id FROM projects WHERE user_id=? AND name=?",
-        (user_id, name),
-    ).fetchone()
-    return int(row2["id"]) if row2 else None
+        pid = int(row["id"])
+    else:
+        with DB_LOCK:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO projects (user_id, name, created_at) VALUES (?, ?, ?)",
+                (user_id, name, now_utc_iso()),
+            )
+            conn.commit()
+            pid = int(cur.lastrowid) if cur.rowcount == 1 else None
+        if pid is None:
+            # another thread won the race; the row exists now
+            row2 = conn.execute(
+                "SELECT id FROM projects WHERE user_id=? AND name=?",
+                (user_id, name),
+            ).fetchone()
+            if not row2:
+                return None
+            pid = int(row2["id"])
+
+    if len(_project_cache) >= PROJECT_CACHE_MAX:
+        _project_cache.clear()
+    _project_cache[key] = pid
+    return pid
 
 def set_session_cookie(resp: Response, token: str) -> None:
     # SameSite=Lax works well for normal usage
@@ -191,7 +344,7 @@ def set_session_cookie(resp: Response, token: str) -> None:
         key=COOKIE_NAME,
         value=token,
         httponly=True,
-        secure=bool(PUBLIC_BASE_URL.startswith("https://")),
+        secure=COOKIE_SECURE,
         samesite="lax",
         max_age=SESSION_DAYS * 24 * 60 * 60,
         path="/",
@@ -202,105 +355,147 @@ def clear_session_cookie(resp: Response) -> None:
 
 
 # ========= AUTH DEPENDENCIES =========
-def get_current_session(request: Request) -> Optional[sqlite3.Row]:
+def _token_digest(token: str) -> str:
+    """Digest under which a session token is stored in the DB.
+
+    Only the hash touches disk, so a dumped database does not hand out
+    live bearer credentials; the raw token exists solely in the cookie.
+    blake2b beats sha256 in CPython and 128 bits is ample for a lookup
+    key of a 256-bit random token.
+    """
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Sessions live for 30 days but get re-read on every authenticated
+# request; a short in-process TTL cache absorbs those lookups. Entries
+# are dropped on logout and owner lock/unlock so permission changes
+# take effect immediately.
+SESSION_CACHE_TTL = 60.0
+SESSION_CACHE_MAX = 4096
+_session_cache: Dict[str, tuple] = {}
+_session_cache_lock = threading.Lock()
+
+def _session_cache_get(token: str) -> Optional[Dict[str, Any]]:
+    with _session_cache_lock:
+        hit = _session_cache.get(token)
+        if hit is None:
+            return None
+        if hit[0] < time.monotonic():
+            del _session_cache[token]
+            return None
+        return hit[1]
+
+def _session_cache_put(token: str, sess: Dict[str, Any]) -> None:
+    with _session_cache_lock:
+        if len(_session_cache) >= SESSION_CACHE_MAX:
+            _session_cache.clear()
+        _session_cache[token] = (time.monotonic() + SESSION_CACHE_TTL, sess)
+
+def _session_cache_drop(token: str) -> None:
+    with _session_cache_lock:
+        _session_cache.pop(token, None)
+
+def get_current_session(request: Request) -> Optional[Dict[str, Any]]:
     token = request.cookies.get(COOKIE_NAME)
     if not token:
         return None
-    conn = db_connect()
-    try:
-        row = conn.execute(
-            "SELECT token, user_id, is_owner, expires_at FROM sessions WHERE token=?",
-            (token,),
-        ).fetchone()
+
+    sess = _session_cache_get(token)
+    if sess is None:
+        conn = db_connect()
+        row = conn.execute(SQL_SESSION_LOOKUP, (_token_digest(token),)).fetchone()
         if not row:
             return None
-        # expiry check
+        sess = dict(row)
+        _session_cache_put(token, sess)
+
+    # expiry check — expires_at and now_utc_iso() use the same UTC isoformat
+    # layout, so plain string comparison sorts chronologically and we skip a
+    # datetime parse + object build on every authenticated request.
+    # The expired row itself is left for the GC thread; deleting it here
+    # would put a write transaction (and fsync) on the read path.
+    if sess["expires_at"] <= now_utc_iso():
+        _session_cache_drop(token)
+        return None
+    return sess
+
+SESSION_GC_INTERVAL = 300.0
+
+def _session_gc() -> None:
+    """Purge expired session rows in the background, off the auth path."""
+    conn = db_connect()
+    while True:
+        time.sleep(SESSION_GC_INTERVAL)
         try:
-            exp = datetime.fromisoformat(row["expires_at"])
-            if exp < datetime.now(timezone.utc):
-                conn.execute("DELETE FROM sessions WHERE token=?", (token,))
+            with DB_LOCK:
+                conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now_utc_iso(),))
                 conn.commit()
-                return None
-        except Exception:
-            return None
-        return row
-    finally:
-        conn.close()
+        except Exception as e:
+            print("[session_gc] cleanup failed:", e)
 
-def get_current_user(request: Request) -> sqlite3.Row:
+def get_current_user(request: Request) -> Dict[str, Any]:
     sess = get_current_session(request)
     if not sess:
         raise HTTPException(status_code=401, detail="Not logged in")
-    conn = db_connect()
-    try:
-        u = conn.execute("SELECT * FROM users WHERE id=?", (int(sess["user_id"]),)).fetchone()
-        if not u:
-            raise HTTPException(status_code=401, detail="Not logged in")
-        return u
-    finally:
-        conn.close()
-
-def require_owner(request: Request) -> sqlite3.Row:
+    return {"id": sess["user_id"], "email": sess["email"]}
+
+def require_owner(request: Request) -> Dict[str, Any]:
     sess = get_current_session(request)
-    if not sess or int(sess["is_owner"]) != 1:
+    if not sess or sess["is_owner"] != 1:
         raise HTTPException(status_code=403, detail="Owner/Admin not unlocked")
-    conn = db_connect()
-    try:
-        u = conn.execute("SELECT * FROM users WHERE id=?", (int(sess["user_id"]),)).fetchone()
-        if not u:
-            raise HTTPException(status_code=401, detail="Not logged in")
-        return u
-    finally:
-        conn.close()
+    return {"id": sess["user_id"], "email": sess["email"]}
 
 
 # ========= STARTUP =========
 @app.on_event("startup")
 def on_startup():
     init_db()
+    threading.Thread(target=_event_writer, daemon=True, name="analytics-writer").start()
+    threading.Thread(target=_session_gc, daemon=True, name="session-gc").start()
+    if openai_client is None:
+        print("[startup] OPENAI_API_KEY not configured — /generate will return a warning")
     if stripe is not None and STRIPE_SECRET_KEY:
         stripe.api_key = STRIPE_SECRET_KEY
 
+@app.on_event("shutdown")
+def on_shutdown():
+    # PRAGMA optimize re-analyzes only the tables whose stats look stale,
+    # so the next boot starts with a fresh query planner picture.
+    if _db_conn is not None:
+        with DB_LOCK:
+            _db_conn.execute("PRAGMA optimize")
+            _db_conn.commit()
+
 
 # ========= STATIC HOME =========
 @app.get("/", response_class=HTMLResponse)
-def home():
-    index_path = os.path.join(static_dir, "index.html")
-    if os.path.exists(index_path):
-        with open(index_path, "r", encoding="utf-8") as f:
-            return HTMLResponse(f.read())
-    return HTMLResponse("<h1>Book Worm AI</h1><p>Missing static/index.html</p>")
+async def home(request: Request):
+    if request.headers.get("if-none-match") == INDEX_ETAG:
+        return Response(status_code=304, headers={"etag": INDEX_ETAG})
+    return HTMLResponse(INDEX_HTML, headers={"etag": INDEX_ETAG, "cache-control": "no-cache"})
 
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True, "app": APP_NAME, "time": now_utc_iso()}
 
 
 # ========= SETTINGS =========
 @app.get("/api/settings")
-def api_settings(request: Request):
+async def api_settings(request: Request):
     sess = get_current_session(request)
     me = {"logged_in": False}
     if sess:
-        conn = db_connect()
-        try:
-            u = conn.execute("SELECT email FROM users WHERE id=?", (int(sess["user_id"]),)).fetchone()
-            if u:
-                me = {
-                    "logged_in": True,
-                    "email": u["email"],
-                    "is_owner": bool(int(sess["is_owner"])),
-                }
-        finally:
-            conn.close()
-
-    tabs = ["chat", "writing", "gamedev", "musicdev", "imagelab", "voicelab", "gamedesigner"]
+        me = {
+            "logged_in": True,
+            "email": sess["email"],
+            "is_owner": bool(sess["is_owner"]),
+        }
 
     return {
         "app": APP_NAME,
         "studio_url": PUBLIC_BASE_URL or "http://127.0.0.1:5050",
-        "tabs": tabs,
-        "stripe_ready": bool(STRIPE_SECRET_KEY and stripe is not None and STRIPE_BASIC_PRICE_ID and STRIPE_PRO_PRICE_ID and STRIPE_PATRON_PRICE_ID),
+        "tabs": TABS,
+        "stripe_ready": STRIPE_READY,
         "me": me,
     }
 
@@ -308,78 +503,66 @@ def api_settings(request: Request):
 # ========= AUTH ROUTES =========
 @app.post("/auth/register")
 def auth_register(req: RegisterRequest):
+    email = req.email.lower()
+    pw_hash = hash_password(req.password)
     conn = db_connect()
+    # UNIQUE(email) does the existence check; user + starter subscription
+    # land in one transaction (one fsync) instead of four statements.
     try:
-        existing = conn.execute("SELECT id FROM users WHERE email=?", (req.email.lower(),)).fetchone()
-        if existing:
-            raise HTTPException(status_code=400, detail="Email already registered")
-
-        pw_hash = hash_password(req.password)
-        conn.execute(
-            "INSERT INTO users (email, password_hash, created_at) VALUES (?, ?, ?)",
-            (req.email.lower(), pw_hash, now_utc_iso()),
-        )
-        conn.commit()
-
-        # create starter subscription record
-        user = conn.execute("SELECT id FROM users WHERE email=?", (req.email.lower(),)).fetchone()
-        if user:
+        with DB_LOCK:
+            cur = conn.execute(
+                "INSERT INTO users (email, password_hash, created_at) VALUES (?, ?, ?) RETURNING id",
+                (email, pw_hash, now_utc_iso()),
+            )
+            user_id = int(cur.fetchone()[0])
             conn.execute(
                 "INSERT OR REPLACE INTO subscriptions (user_id, plan, status, updated_at) VALUES (?, 'free', 'active', ?)",
-                (int(user["id"]), now_utc_iso()),
+                (user_id, now_utc_iso()),
             )
             conn.commit()
+    except sqlite3.IntegrityError:
+        with DB_LOCK:
+            conn.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
 
-        return {"ok": True}
-    finally:
-        conn.close()
+    return {"ok": True}
 
 @app.post("/auth/login")
 def auth_login(req: LoginRequest, response: Response):
     conn = db_connect()
-    try:
-        u = conn.execute("SELECT * FROM users WHERE email=?", (req.email.lower(),)).fetchone()
-        if not u or not verify_password(req.password, u["password_hash"]):
-            raise HTTPException(status_code=401, detail="Invalid email or password")
+    u = conn.execute("SELECT id, email, password_hash FROM users WHERE email=?", (req.email.lower(),)).fetchone()
+    if not u or not verify_password(req.password, u["password_hash"]):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
 
-        token = secrets.token_urlsafe(32)
+    token = secrets.token_urlsafe(32)
+    with DB_LOCK:
         conn.execute(
             "INSERT INTO sessions (token, user_id, is_owner, created_at, expires_at) VALUES (?, ?, 0, ?, ?)",
-            (token, int(u["id"]), now_utc_iso(), iso_in_days(SESSION_DAYS)),
+            (_token_digest(token), u["id"], now_utc_iso(), iso_in_days(SESSION_DAYS)),
         )
         conn.commit()
 
-        set_session_cookie(response, token)
-        return {"ok": True, "email": u["email"]}
-    finally:
-        conn.close()
+    set_session_cookie(response, token)
+    return {"ok": True, "email": u["email"]}
 
 @app.post("/auth/logout")
 def auth_logout(request: Request, response: Response):
     token = request.cookies.get(COOKIE_NAME)
     if token:
+        _session_cache_drop(token)
         conn = db_connect()
-        try:
-            conn.execute("DELETE FROM sessions WHERE token=?", (token,))
+        with DB_LOCK:
+            conn.execute("DELETE FROM sessions WHERE token=?", (_token_digest(token),))
             conn.commit()
-        finally:
-            conn.close()
     clear_session_cookie(response)
     return {"ok": True}
 
 @app.get("/auth/me")
-def auth_me(request: Request):
+async def auth_me(request: Request):
     sess = get_current_session(request)
     if not sess:
         return {"logged_in": False}
-    conn = db_connect()
-    try:
-        u = conn.execute("SELECT email FROM users WHERE id=?", (int(sess["user_id"]),)).fetchone()
-        if not u:
-            return {"logged_in": False}
-        return {"logged_in": True, "email": u["email"], "is_owner": bool(int(sess["is_owner"]))}
-    finally:
-        conn.close()
+    return {"logged_in": True, "email": sess["email"], "is_owner": bool(sess["is_owner"])}
 
 
 # ========= OWNER / ADMIN =========
@@ -390,18 +573,18 @@ def owner_unlock(req: OwnerUnlockRequest, request: Request, response: Response):
     if not sess:
         raise HTTPException(status_code=401, detail="Not logged in")
 
-    if not BOOKWORM_OWNER_CODE:
+    if not OWNER_CODE_BYTES:
         raise HTTPException(status_code=500, detail="BOOKWORM_OWNER_CODE not configured on server")
 
-    if (req.code or "").strip() != BOOKWORM_OWNER_CODE.strip():
+    if not hmac.compare_digest((req.code or "").strip().encode("utf-8"), OWNER_CODE_BYTES):
         raise HTTPException(status_code=403, detail="Invalid owner code")
 
     conn = db_connect()
-    try:
+    with DB_LOCK:
         conn.execute("UPDATE sessions SET is_owner=1 WHERE token=?", (sess["token"],))
         conn.commit()
-    finally:
-        conn.close()
+    # The cache is keyed by the raw cookie token, not the stored digest.
+    _session_cache_drop(request.cookies.get(COOKIE_NAME, ""))
 
     return {"ok": True}
 
@@ -411,128 +594,139 @@ def owner_lock(request: Request):
     if not sess:
         raise HTTPException(status_code=401, detail="Not logged in")
     conn = db_connect()
-    try:
+    with DB_LOCK:
         conn.execute("UPDATE sessions SET is_owner=0 WHERE token=?", (sess["token"],))
         conn.commit()
-    finally:
-        conn.close()
+    _session_cache_drop(request.cookies.get(COOKIE_NAME, ""))
     return {"ok": True}
 
 @app.get("/debug/owner")
-def debug_owner():
+async def debug_owner():
     # Safe debug: no secret revealed
     v = os.getenv("BOOKWORM_OWNER_CODE", "")
     return {"owner_env_present": bool(v), "owner_len": len(v) if v else 0}
 
 
 # ========= MESSAGES / HISTORY =========
-def store_message(user_id: int, tab: str, role: str, content: str, project_id: Optional[int]) -> None:
+def store_turn(user_id: int, tab: str, prompt: str, reply: str, project_id: Optional[int]) -> None:
+    """Store one user/assistant exchange in a single transaction."""
     conn = db_connect()
-    try:
-        conn.execute(
-            "INSERT INTO messages (user_id, project_id, tab, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, project_id, tab, role, content, now_utc_iso()),
+    ts = now_utc_iso()
+    with DB_LOCK:
+        conn.executemany(
+            SQL_INSERT_MESSAGE,
+            [
+                (user_id, project_id, tab, "user", prompt, ts),
+                (user_id, project_id, tab, "assistant", reply, ts),
+            ],
         )
         conn.commit()
-    finally:
-        conn.close()
 
 def load_recent_messages(user_id: int, tab: str, project_id: Optional[int], limit: int = 18) -> List[Dict[str, Any]]:
     conn = db_connect()
+    if project_id is None:
+        rows = conn.execute(SQL_RECENT_MESSAGES_NULL, (user_id, tab, limit)).fetchall()
+    else:
+        rows = conn.execute(SQL_RECENT_MESSAGES_PID, (user_id, tab, project_id, limit)).fetchall()
+    items = [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
+    return items
+
+# Analytics are fire-and-forget: requests enqueue, a daemon thread
+# batches inserts so the commit/fsync cost is amortized across many
+# events instead of landing on every /generate.
+EVENT_QUEUE: "queue.Queue[tuple]" = queue.Queue(maxsize=10_000)
+EVENT_BATCH_MAX = 100
+
+def log_event(user_id: Optional[int], event: str, meta: Dict[str, Any]) -> None:
     try:
-        if project_id is None:
-            rows = conn.execute(
-                "SELECT role, content FROM messages WHERE user_id=? AND tab=? AND project_id IS NULL ORDER BY id DESC LIMIT ?",
-                (user_id, tab, limit),
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                "SELECT role, content FROM messages WHERE user_id=? AND tab=? AND project_id=? ORDER BY id DESC LIMIT ?",
-                (user_id, tab, project_id, limit),
-            ).fetchall()
-        items = [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
-        return items
-    finally:
-        conn.close()
+        EVENT_QUEUE.put_nowait((user_id, event, orjson.dumps(meta).decode(), now_utc_iso()))
+    except queue.Full:
+        # best-effort telemetry; dropping beats blocking a request
+        pass
+
+def _event_writer() -> None:
+    conn = db_connect()
+    while True:
+        batch = [EVENT_QUEUE.get()]
+        try:
+            while len(batch) < EVENT_BATCH_MAX:
+                batch.append(EVENT_QUEUE.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            with DB_LOCK:
+                conn.executemany(SQL_INSERT_EVENT, batch)
+                conn.commit()
+        except Exception as e:
+            print("[event_writer] failed to flush analytics batch:", e)
 
 
 # ========= CANON =========
 @app.post("/canon/save")
-def canon_save(req: SaveCanonRequest, user: sqlite3.Row = Depends(get_current_user)):
+def canon_save(req: SaveCanonRequest, user: Dict[str, Any] = Depends(get_current_user)):
     tab = normalize_tab(req.tab)
     if not req.title.strip() or not req.content.strip():
         raise HTTPException(status_code=400, detail="title and content required")
 
     conn = db_connect()
-    try:
-        project_id = ensure_project(conn, int(user["id"]), req.project)
+    project_id = ensure_project(conn, user["id"], req.project)
+    with DB_LOCK:
         conn.execute(
             "INSERT INTO canon_items (user_id, project_id, tab, title, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (int(user["id"]), project_id, tab, req.title.strip(), req.content.strip(), now_utc_iso()),
+            (user["id"], project_id, tab, req.title.strip(), req.content.strip(), now_utc_iso()),
         )
         conn.commit()
-    finally:
-        conn.close()
 
     return {"ok": True}
 
 @app.get("/canon/list")
-def canon_list(tab: str = "chat", project: Optional[str] = None, user: sqlite3.Row = Depends(get_current_user)):
+def canon_list(tab: str = "chat", project: Optional[str] = None, user: Dict[str, Any] = Depends(get_current_user)):
     tab = normalize_tab(tab)
     conn = db_connect()
-    try:
-        pid = ensure_project(conn, int(user["id"]), project) if project else None
-        if pid is None:
-            rows = conn.execute(
-                "SELECT id, tab, title, content, created_at FROM canon_items WHERE user_id=? AND tab=? AND project_id IS NULL ORDER BY id DESC LIMIT 200",
-                (int(user["id"]), tab),
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                "SELECT id, tab, title, content, created_at FROM canon_items WHERE user_id=? AND tab=? AND project_id=? ORDER BY id DESC LIMIT 200",
-                (int(user["id"]), tab, pid),
-            ).fetchall()
-        return {"items": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+    pid = ensure_project(conn, user["id"], project) if project else None
+    if pid is None:
+        rows = conn.execute(
+            "SELECT id, tab, title, content, created_at FROM canon_items WHERE user_id=? AND tab=? AND project_id IS NULL ORDER BY id DESC LIMIT 200",
+            (user["id"], tab),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, tab, title, content, created_at FROM canon_items WHERE user_id=? AND tab=? AND project_id=? ORDER BY id DESC LIMIT 200",
+            (user["id"], tab, pid),
+        ).fetchall()
+    return {"items": [dict(r) for r in rows]}
 
 
 # ========= GENERATE =========
+# Cap outbound concurrency so a traffic burst does not fan out into
+# unbounded OpenAI calls that 429 and retry.
+OPENAI_SEM = asyncio.Semaphore(OPENAI_MAX_INFLIGHT)
+
 @app.post("/generate")
-def generate(req: GenerateRequest, user: sqlite3.Row = Depends(get_current_user)):
+async def generate(req: GenerateRequest, user: Dict[str, Any] = Depends(get_current_user)):
     tab = normalize_tab(req.tab)
     prompt = (req.prompt or "").strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
 
+    user_id = user["id"]
     conn = db_connect()
-    try:
-        project_id = ensure_project(conn, int(user["id"]), req.project)
-    finally:
-        conn.close()
-
-    store_message(int(user["id"]), tab, "user", prompt, project_id)
+    project_id = await asyncio.to_thread(ensure_project, conn, user_id, req.project)
 
-    if not OPENAI_API_KEY or OpenAI is None:
-        text = (
-            "⚠ OPENAI_API_KEY is not configured on this server.\n"
-            "Set OPENAI_API_KEY in Render Environment Variables, then redeploy."
-        )
-        store_message(int(user["id"]), tab, "assistant", text, project_id)
-        return {"response": text}
+    if openai_client is None:
+        await asyncio.to_thread(store_turn, user_id, tab, prompt, OPENAI_MISSING_TEXT, project_id)
+        return {"response": OPENAI_MISSING_TEXT}
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    history = load_recent_messages(int(user["id"]), tab, project_id, limit=18)
-    system = system_prompt_for_tab(tab)
+    client = openai_client
+    history = await asyncio.to_thread(load_recent_messages, user_id, tab, project_id, 18)
+    system_msg = system_message_for_tab(tab)
 
     try:
-        resp = client.responses.create(
-            model=OPENAI_MODEL,
-            input=[
-                {"role": "system", "content": system},
-                *history
-            ],
-        )
+        async with OPENAI_SEM:
+            resp = await client.responses.create(
+                model=OPENAI_MODEL,
+                input=[system_msg, *history, {"role": "user", "content": prompt}],
+            )
         try:
             text = resp.output_text  # type: ignore
         except Exception:
@@ -548,20 +742,61 @@ def generate(req: GenerateRequest, user: sqlite3.Row = Depends(get_current_user)
     except Exception as e:
         text = f"⚠ AI error: {str(e)}"
 
-    store_message(int(user["id"]), tab, "assistant", text, project_id)
-
-    conn2 = db_connect()
-    try:
-        conn2.execute(
-            "INSERT INTO analytics_events (user_id, event, meta_json, created_at) VALUES (?, 'generate', ?, ?)",
-            (int(user["id"]), json.dumps({"tab": tab}), now_utc_iso()),
-        )
-        conn2.commit()
-    finally:
-        conn2.close()
+    await asyncio.to_thread(store_turn, user_id, tab, prompt, text, project_id)
+    log_event(user_id, "generate", {"tab": tab})
 
     return {"response": text}
 
+@app.post("/generate/stream")
+async def generate_stream(req: GenerateRequest, user: Dict[str, Any] = Depends(get_current_user)):
+    """Same as /generate but streams the completion as Server-Sent Events.
+
+    Each chunk arrives as `data: {"delta": "..."}` and the stream ends
+    with `data: [DONE]`. The full text is stored in history once the
+    stream finishes, exactly like the buffered endpoint.
+    """
+    tab = normalize_tab(req.tab)
+    prompt = (req.prompt or "").strip()
+    if not prompt:
+        raise HTTPException(status_code=400, detail="Prompt is required")
+    if openai_client is None:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured on this server")
+
+    user_id = user["id"]
+    conn = db_connect()
+    project_id = await asyncio.to_thread(ensure_project, conn, user_id, req.project)
+
+    client = openai_client
+    history = await asyncio.to_thread(load_recent_messages, user_id, tab, project_id, 18)
+    system_msg = system_message_for_tab(tab)
+
+    async def event_stream():
+        pieces: List[str] = []
+        try:
+            async with OPENAI_SEM:
+                stream = await client.responses.create(
+                    model=OPENAI_MODEL,
+                    input=[system_msg, *history, {"role": "user", "content": prompt}],
+                    stream=True,
+                )
+                async for event in stream:
+                    if getattr(event, "type", "") == "response.output_text.delta":
+                        delta = getattr(event, "delta", "") or ""
+                        if delta:
+                            pieces.append(delta)
+                            yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+        except Exception as e:
+            err = f"⚠ AI error: {str(e)}"
+            pieces.append(err)
+            yield b"data: " + orjson.dumps({"delta": err}) + b"\n\n"
+
+        text = "".join(pieces) or "⚠ No text returned."
+        await asyncio.to_thread(store_turn, user_id, tab, prompt, text, project_id)
+        log_event(user_id, "generate", {"tab": tab})
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 
 # ========= STRIPE =========
 def stripe_configured() -> bool:
@@ -578,7 +813,7 @@ def price_id_for_plan(plan: str) -> str:
     return ""
 
 @app.get("/debug/stripe")
-def debug_stripe():
+async def debug_stripe():
     return {
         "has_secret_key": bool(STRIPE_SECRET_KEY),
         "has_webhook_secret": bool(STRIPE_WEBHOOK_SECRET),
@@ -591,7 +826,7 @@ def debug_stripe():
     }
 
 @app.post("/stripe/create-checkout-session")
-def stripe_create_checkout(req: CheckoutRequest, request: Request, user: sqlite3.Row = Depends(get_current_user)):
+def stripe_create_checkout(req: CheckoutRequest, request: Request, user: Dict[str, Any] = Depends(get_current_user)):
     if not stripe_configured():
         raise HTTPException(status_code=500, detail="Stripe not configured on server")
 
@@ -606,19 +841,17 @@ def stripe_create_checkout(req: CheckoutRequest, request: Request, user: sqlite3
 
     # get or create customer id
     conn = db_connect()
-    try:
-        sub = conn.execute("SELECT stripe_customer_id FROM subscriptions WHERE user_id=?", (int(user["id"]),)).fetchone()
-        customer_id = sub["stripe_customer_id"] if sub else None
-        if not customer_id:
-            cust = stripe.Customer.create(email=user["email"])
-            customer_id = cust["id"]
+    sub = conn.execute("SELECT stripe_customer_id FROM subscriptions WHERE user_id=?", (user["id"],)).fetchone()
+    customer_id = sub["stripe_customer_id"] if sub else None
+    if not customer_id:
+        cust = stripe.Customer.create(email=user["email"])
+        customer_id = cust["id"]
+        with DB_LOCK:
             conn.execute(
                 "INSERT OR REPLACE INTO subscriptions (user_id, plan, stripe_customer_id, status, updated_at) VALUES (?, 'free', ?, 'active', ?)",
-                (int(user["id"]), customer_id, now_utc_iso()),
+                (user["id"], customer_id, now_utc_iso()),
             )
             conn.commit()
-    finally:
-        conn.close()
 
     session = stripe.checkout.Session.create(
         mode="subscription",
@@ -630,12 +863,38 @@ def stripe_create_checkout(req: CheckoutRequest, request: Request, user: sqlite3
     )
     return {"url": session["url"]}
 
+# Stripe retries deliveries aggressively; remembering recently-seen event
+# ids lets redeliveries short-circuit before re-running the subscription
+# update. Same bounded-dict shape as the session cache.
+WEBHOOK_SEEN_TTL = 600.0
+WEBHOOK_SEEN_MAX = 4096
+_webhook_seen: Dict[str, float] = {}
+_webhook_seen_lock = threading.Lock()
+
+def _webhook_seen_before(event_id: str) -> bool:
+    now = time.monotonic()
+    with _webhook_seen_lock:
+        deadline = _webhook_seen.get(event_id)
+        if deadline is not None and deadline > now:
+            return True
+        if len(_webhook_seen) >= WEBHOOK_SEEN_MAX:
+            _webhook_seen.clear()
+        _webhook_seen[event_id] = now + WEBHOOK_SEEN_TTL
+        return False
+
 @app.post("/stripe/webhook")
 async def stripe_webhook(request: Request):
     if not stripe_configured() or not STRIPE_WEBHOOK_SECRET:
         return JSONResponse({"ok": False, "detail": "Stripe webhook not configured"}, status_code=500)
 
-    payload = await request.body()
+    # Stripe events are a few KB; cap the body so an oversized (or hostile)
+    # payload cannot balloon worker memory before the signature check.
+    buf = bytearray()
+    async for chunk in request.stream():
+        buf += chunk
+        if len(buf) > WEBHOOK_MAX_BYTES:
+            return JSONResponse({"ok": False, "detail": "Payload too large"}, status_code=413)
+    payload = bytes(buf)
     sig = request.headers.get("stripe-signature", "")
 
     try:
@@ -643,6 +902,10 @@ async def stripe_webhook(request: Request):
     except Exception as e:
         return JSONResponse({"ok": False, "detail": f"Webhook error: {str(e)}"}, status_code=400)
 
+    event_id = event.get("id", "")
+    if event_id and _webhook_seen_before(event_id):
+        return {"ok": True, "dedup": True}
+
     etype = event.get("type", "")
     obj = event.get("data", {}).get("object", {})
 
@@ -651,59 +914,67 @@ async def stripe_webhook(request: Request):
         customer_id = obj.get("customer") or obj.get("customer_id")
         subscription_id = obj.get("subscription") or obj.get("id")
         status = obj.get("status", "active")
-
-        conn = db_connect()
-        try:
-            row = conn.execute("SELECT user_id FROM subscriptions WHERE stripe_customer_id=?", (customer_id,)).fetchone()
-            if row:
-                plan = "paid"
-                conn.execute(
-                    "UPDATE subscriptions SET plan=?, stripe_subscription_id=?, status=?, updated_at=? WHERE user_id=?",
-                    (plan, subscription_id, status, now_utc_iso(), int(row["user_id"])),
-                )
-                conn.commit()
-        finally:
-            conn.close()
+        await asyncio.to_thread(_apply_subscription_update, customer_id, subscription_id, status)
 
     return {"ok": True}
 
+def _apply_subscription_update(customer_id: Optional[str], subscription_id: Optional[str], status: str) -> None:
+    conn = db_connect()
+    row = conn.execute("SELECT user_id FROM subscriptions WHERE stripe_customer_id=?", (customer_id,)).fetchone()
+    if row:
+        plan = "paid"
+        with DB_LOCK:
+            conn.execute(
+                "UPDATE subscriptions SET plan=?, stripe_subscription_id=?, status=?, updated_at=? WHERE user_id=?",
+                (plan, subscription_id, status, now_utc_iso(), int(row["user_id"])),
+            )
+            conn.commit()
+
 
 # ========= ADMIN =========
 @app.get("/admin/analytics")
-def admin_analytics(owner: sqlite3.Row = Depends(require_owner)):
+def admin_analytics(owner: Dict[str, Any] = Depends(require_owner)):
     conn = db_connect()
-    try:
-        rows = conn.execute(
-            "SELECT event, COUNT(*) as c FROM analytics_events GROUP BY event ORDER BY c DESC"
-        ).fetchall()
-        return {"events": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+    rows = conn.execute(
+        "SELECT event, COUNT(*) as c FROM analytics_events GROUP BY event ORDER BY c DESC"
+    ).fetchall()
+    return {"events": [dict(r) for r in rows]}
 
 @app.get("/admin/users")
-def admin_users(owner: sqlite3.Row = Depends(require_owner)):
+def admin_users(owner: Dict[str, Any] = Depends(require_owner)):
     conn = db_connect()
-    try:
-        rows = conn.execute(
-            "SELECT id, email, created_at FROM users ORDER BY id DESC LIMIT 200"
-        ).fetchall()
-        return {"users": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+    rows = conn.execute(
+        "SELECT id, email, created_at FROM users ORDER BY id DESC LIMIT 200"
+    ).fetchall()
+    return {"users": [dict(r) for r in rows]}
 
 @app.get("/admin/subscriptions")
-def admin_subscriptions(owner: sqlite3.Row = Depends(require_owner)):
+def admin_subscriptions(owner: Dict[str, Any] = Depends(require_owner)):
     conn = db_connect()
-    try:
-        rows = conn.execute(
-            """
-            SELECT u.email, s.plan, s.status, s.updated_at
-            FROM subscriptions s
-            JOIN users u ON u.id = s.user_id
-            ORDER BY s.updated_at DESC
-            LIMIT 200
-            """
-        ).fetchall()
-        return {"subs": [dict(r) for r in rows]}
-    finally:
-        conn.close()
+    rows = conn.execute(
+        """
+        SELECT u.email, s.plan, s.status, s.updated_at
+        FROM subscriptions s
+        JOIN users u ON u.id = s.user_id
+        ORDER BY s.updated_at DESC
+        LIMIT 200
+        """
+    ).fetchall()
+    return {"subs": [dict(r) for r in rows]}
+
+
+# ========= ENTRYPOINT =========
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools give a C event loop and HTTP parser; WAL-mode
+    # SQLite is safe to share across worker processes.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5050")),
+        workers=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )